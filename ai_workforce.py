@@ -4,11 +4,10 @@
 # Purpose:
 # Prepare a dataset containing AI workforce information at the firm-year level.
 # 
-# This script has 4 parts:
+# This script has 3 parts:
 # (1) Identify individuals with AI-related skills using Revelio Lab's data.
 # (2) Refine the dataset using Part 1 results.
-# (3) Generate firm-year level variables.
-# (4) Export a final .csv file where each row represents a unique firm-year record.
+# (3) Generate firm-year level variables and export a final .parquet file.
 #
 # Last update: Oct 29, 2024
 # Data Source: Revelio Labs and Alekseeva et al. (2021) AI Skills List
@@ -20,58 +19,98 @@
 # ========================================================
 # - AI-related skills list loaded from 'AI_related_skills.xlsx'
 # - Filter individuals with AI skills from Revelio Lab data files.
-# - Output: Interim filtered files saved as .csv
+# - Output: Combined filtered file saved as .parquet (per-file interim copies only when DEBUG is set)
 # --------------------------------------------------------
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import os
-import gc  # Garbage collector
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
 # Paths and Setup
 excel_path = r"~\AI_related_skills.xlsx"
 input_directory = r"~\academic_individual_user_skill"
 interim_output_path = r"~\interim"
-final_output_path = r"~\final_combined_skills.csv"
+final_output_path = r"~\final_combined_skills.parquet"
+DEBUG = False  # Also save each filtered file to interim_output_path for inspection
 
 # Load the AI-related skills list
-ai_skills = pd.read_excel(excel_path)
+ai_skills = pd.read_excel(excel_path, usecols=['skill'], dtype={'skill': 'string[pyarrow]'})
 skills_list = ai_skills['skill'].str.strip().str.lower().tolist()
 
 # Check if the correct number of skills is identified
 assert len(skills_list) == 81, f"Expected 81 skills, but found {len(skills_list)}"
 
-# Ensure the interim and final output directories exist
-os.makedirs(interim_output_path, exist_ok=True)
+# Build the lookup set once and reuse it for every file
+skills_set = frozenset(skills_list)
+
+skills_value_set = pa.array(sorted(skills_set), type=pa.string())
+skill_columns = ['user_id', 'skill_raw', 'skill_mapped']  # Only columns needed for filtering
+
+batch_size = 262144  # Rows per record batch when streaming each file
+
+# Skill columns are read dictionary-encoded, so Arrow's UTF-8 kernels and the
+# membership test run once per distinct skill string rather than once per row
+def normalize_skill_column(column):
+    """Trim/lower-case a dictionary-encoded skill array; returns (values, is_AI_skill mask)."""
+    dictionary = pc.utf8_lower(pc.utf8_trim_whitespace(column.dictionary))
+    values = pa.DictionaryArray.from_arrays(column.indices, dictionary)
+    return values, pc.take(pc.is_in(dictionary, value_set=skills_value_set), column.indices)
+
+# Ensure the output directories exist
+if DEBUG:
+    os.makedirs(interim_output_path, exist_ok=True)
 os.makedirs(os.path.dirname(final_output_path), exist_ok=True)
 
-# Process each Revelio Lab file
-all_filtered_data = []
-for i in tqdm(range(406), desc="Processing Files", ncols=100):
+# Helper Function
+def filter_skill_file(i):
+    """Filter one Revelio Lab file; returns (filename, table or None)."""
     filename = f"individual_user_skill_{i:04d}_part_00.parquet"
     input_file = os.path.join(input_directory, filename)
 
     if not os.path.exists(input_file):
-        print(f"File not found: {filename}, skipping...")
-        continue
-
-    # Load and filter the file
-    df = pd.read_parquet(input_file)
-    df['skill_raw'] = df['skill_raw'].str.strip().str.lower()
-    df['skill_mapped'] = df['skill_mapped'].str.strip().str.lower()
-    filtered_df = df[df['skill_raw'].isin(skills_list) | df['skill_mapped'].isin(skills_list)]
-
-    # Save interim results
-    interim_file = os.path.join(interim_output_path, f"interim_{filename.replace('.parquet', '.csv')}")
-    filtered_df.to_csv(interim_file, index=False)
-    all_filtered_data.append(filtered_df)
-
-    del df, filtered_df
-    gc.collect()
-
-# Combine and save final results
-if all_filtered_data:
-    final_combined_df = pd.concat(all_filtered_data, ignore_index=True)
-    final_combined_df.to_csv(final_output_path, index=False)
+        return filename, None
+
+    # Stream the filtering columns batch by batch, normalizing and matching in Arrow,
+    # so only the matching rows of a file are ever held in memory
+    parquet_file = pq.ParquetFile(input_file, read_dictionary=['skill_raw', 'skill_mapped'])
+    filtered_batches = []
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=skill_columns):
+        skill_raw, raw_is_AI_skill = normalize_skill_column(batch.column('skill_raw'))
+        skill_mapped, mapped_is_AI_skill = normalize_skill_column(batch.column('skill_mapped'))
+        filtered_batches.append(
+            pa.record_batch([batch.column('user_id'), skill_raw, skill_mapped], names=skill_columns)
+            .filter(pc.or_kleene(raw_is_AI_skill, mapped_is_AI_skill))
+        )
+    schema = pa.schema([parquet_file.schema_arrow.field(column) for column in skill_columns])
+    filtered_table = pa.Table.from_batches(filtered_batches, schema=schema)
+
+    # Only the combined file is used downstream; per-file copies are for debugging
+    if DEBUG:
+        pq.write_table(filtered_table, os.path.join(interim_output_path, f"interim_{filename}"), compression='snappy')
+    return filename, filtered_table
+
+# Process the Revelio Lab files concurrently; Arrow releases the GIL while
+# decompressing and filtering, so threads keep every core busy
+final_writer = None
+with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+    results = executor.map(filter_skill_file, range(406))
+    for filename, filtered_table in tqdm(results, total=406, desc="Processing Files", ncols=100):
+        if filtered_table is None:
+            print(f"File not found: {filename}, skipping...")
+            continue
+
+        # Stream matches into the combined file instead of holding every file in memory
+        if filtered_table.num_rows:
+            if final_writer is None:
+                final_writer = pq.ParquetWriter(final_output_path, filtered_table.schema, compression='zstd')
+            final_writer.write_table(filtered_table)
+
+# Close the combined file
+if final_writer is not None:
+    final_writer.close()
     print(f"Final combined file saved at: {final_output_path}")
 else:
     print("No matching data found.")
@@ -83,120 +122,230 @@ print("Part 1 completed successfully.")
 # (Part 2) Refine the Existing Dataset
 # ========================================================
 # - Add AI skill tags, user roles, and firm-level IDs.
-# - Expand data into panel format using 'startdate' and 'enddate'.
-# - Output: Refined interim files saved in CSV format.
+# - Derive each position's year span from 'startdate' and 'enddate'. Only years in
+#   1900-2024 are kept: a start outside it or an end before 1900 (typos like 0201) drops
+#   the position; a missing, unparseable or later end (sentinels like 9999-12-31) counts
+#   as ongoing through 2024.
+#   (The user-year panel is never materialized; Part 3 counts firm-years from the spans.)
+# - Output: Refined interim files (one row per position) saved in Parquet format.
 # --------------------------------------------------------
 import pandas as pd
 import numpy as np
-import gc
+import pyarrow.parquet as pq
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # Paths and Setup
 input_directory = r"~\combined"
 interim_output_directory = r"~\interim"
-user_skill_file = r"~\final_combined_skills.csv"  
+user_skill_file = r"~\final_combined_skills.parquet"
+rcid_parat_file = r"~\[Revelio - Parat] rcid - id_parat.dta"
+role_tag_file = r"~\[Position] Technical Team roles.dta"
+
+# Valid position years; the last one is also the end year of ongoing positions
+first_year, last_year = 1900, 2024
+
+# Columns (and their dtypes) read from each combined file
+combined_dtypes = {'user_id': 'int64', 'rcid': 'int64', 'role_k1000': 'category', 'startdate': 'string', 'enddate': 'string'}
+
+# Helper Function
+def load_lookup(stata_file, columns):
+    # Decode the Stata file once into a Parquet copy next to it, then read that
+    parquet_file = os.path.splitext(stata_file)[0] + ".parquet"
+    if not os.path.exists(parquet_file) or os.path.getmtime(parquet_file) < os.path.getmtime(stata_file):
+        pd.read_stata(stata_file)[columns].to_parquet(parquet_file, engine='pyarrow', compression='zstd', index=False)
+    return pd.read_parquet(parquet_file, columns=columns)
 
-# Load AI-skilled user IDs
-ai_skilled_users = pd.read_csv(user_skill_file)['user_id'].unique()
+# Load AI-skilled user IDs as a sorted, unique int64 array for binary-search lookups
+ai_skilled_users = np.unique(pq.read_table(user_skill_file, columns=['user_id'])['user_id'].to_numpy()).astype(np.int64)
 
-# Process each file in combined data
-for i in range(1, 1000, 50):  # Process in 50-file batches
+# Load supporting datasets once (they are the same for every batch)
+df2 = load_lookup(rcid_parat_file, ['rcid', 'id_parat'])
+df3 = load_lookup(role_tag_file, ['role_k1000', 'tag'])
+
+# Lookups as plain dicts: Series.map is a direct hash lookup, with no join bookkeeping
+rcid_to_parat = dict(zip(df2['rcid'], df2['id_parat']))
+role_to_tag = dict(zip(df3['role_k1000'], df3['tag']))
+
+# Ensure the interim output directory exists
+os.makedirs(interim_output_directory, exist_ok=True)
+
+# Helper Function
+def process_combined_file(i):
+    """Refine one 50-file combined batch and save it as an interim Parquet file; returns (filename, found)."""
     start = f"{i:04d}"
     end = f"{min(i + 49, 999):04d}"
     filename = f"combined_{start}_{end}.csv"
     input_file = os.path.join(input_directory, filename)
 
     if not os.path.exists(input_file):
-        print(f"File not found: {filename}, skipping...")
-        continue
-
-    df = pd.read_csv(input_file).dropna(subset=['startdate'])
-    df['start_year'] = df['startdate'].astype(str).str[:4].astype(int)
-    df['end_year'] = df['enddate'].fillna('2024').astype(str).str[:4].astype(int)
-
-    # Load supporting datasets
-    df2 = pd.read_stata(r"~\[Revelio - Parat] rcid - id_parat.dta")
-    df3 = pd.read_stata(r"~\[Position] Technical Team roles.dta")
-
-    df = pd.merge(df, df2[['rcid', 'id_parat']], on='rcid', how='left')
-    df = pd.merge(df, df3[['role_k1000', 'tag']], on='role_k1000', how='left')
-
-    # Expand panel data by year
-    df_expanded = pd.DataFrame({
-        col: np.repeat(df[col].values, df['end_year'] - df['start_year'] + 1)
-        for col in df.columns
-    })
-    df_expanded['year'] = [year for start, end in zip(df['start_year'], df['end_year']) for year in range(start, end + 1)]
-    df_expanded['labor_with_AI_skill'] = df_expanded['user_id'].isin(ai_skilled_users).astype(int)
+        return filename, False
+
+    # Arrow's multithreaded CSV reader parses the batch straight into columnar buffers
+    df = pd.read_csv(input_file, engine='pyarrow', usecols=list(combined_dtypes), dtype=combined_dtypes)
+
+    # Parse dates once (cached per unique string) and take the year. Rows with a missing,
+    # unparseable or out-of-window start, or an end before the window, are dropped; a
+    # missing, unparseable or far-future end (e.g. 9999-12-31) counts as ongoing
+    start_years = pd.to_datetime(df['startdate'], format='ISO8601', errors='coerce', cache=True).dt.year
+    end_years = pd.to_datetime(df['enddate'], format='ISO8601', errors='coerce', cache=True).dt.year
+    df['start_year'] = start_years.where(start_years.between(first_year, last_year))
+    df['end_year'] = end_years.mask(end_years > last_year).fillna(last_year)
+    df = (
+        df[df['start_year'].notna() & (df['end_year'] >= first_year)]
+        .drop(columns=['startdate', 'enddate'])
+        .astype({'start_year': 'int16', 'end_year': 'int16'})  # int16 is plenty for a 4-digit year
+    )
+
+    # Order each span so that start_year <= end_year
+    start_years, end_years = df['start_year'].to_numpy(), df['end_year'].to_numpy()
+    df['start_year'], df['end_year'] = np.minimum(start_years, end_years), np.maximum(start_years, end_years)
+
+    # Mapping the categorical role column only looks up each distinct role once
+    df['id_parat'] = df['rcid'].map(rcid_to_parat)
+    df['tag'] = df['role_k1000'].map(role_to_tag)
+
+    # Explicit, compact dtypes after the lookups (nullable where a lookup can miss)
+    df = df.astype({'id_parat': 'Int64', 'tag': 'Int8'})
+
+    # Flag AI-skilled users
+    user_ids = df['user_id'].to_numpy()
+    positions = np.minimum(np.searchsorted(ai_skilled_users, user_ids), ai_skilled_users.size - 1)
+    df['labor_with_AI_skill'] = (ai_skilled_users[positions] == user_ids).astype(np.int8)
 
     # Save interim files
-    interim_file = os.path.join(interim_output_directory, f"interim_{filename}")
-    df_expanded.to_csv(interim_file, index=False)
-    del df, df_expanded
-    gc.collect()
+    interim_file = os.path.join(interim_output_directory, f"interim_{filename.replace('.csv', '.parquet')}")
+    df.to_parquet(interim_file, engine='pyarrow', compression='zstd', compression_level=3, index=False)
+    return filename, True
+
+# Process the batches concurrently; they only share the read-only lookups above.
+# The CSV parser, date parsing and Parquet writer release the GIL for most of their
+# work, and few workers keep the number of full batches held in memory at once small
+with ThreadPoolExecutor(max_workers=min(4, os.cpu_count())) as executor:
+    for filename, found in executor.map(process_combined_file, range(1, 1000, 50)):  # 50-file batches
+        if not found:
+            print(f"File not found: {filename}, skipping...")
 
 print("Part 2 completed successfully.")
 
 
 # ========================================================
-# (Part 3) Generate Firm-Year Level Variables
+# (Part 3) Generate and Export Firm-Year Level Data
 # ========================================================
 # - Create firm-year level metrics, such as counts of AI-skilled individuals.
-# - Output: Filtered interim files with aggregated variables.
+# - Count distinct users per firm-year straight from the Part 2 year spans with a
+#   sweep line (+1 at start_year, -1 after end_year, cumulative sum over years).
+# - Counts are by rcid and, for the same firm-year rows, by the firm's id_parat.
+# - Output: Final dataset with one row per firm-year (rcid, id_parat, year, counts), written as a Parquet file.
 # --------------------------------------------------------
 import pandas as pd
 import numpy as np
+import pyarrow.dataset as ds
 import os
-import gc 
 
 # Paths and Setup
 interim_input_directory = r"~\interim"
-output_directory = r"~\interim"
+final_output_path = r"~\final\firm_year_final.parquet"
 
-# Helper Function
+os.makedirs(os.path.dirname(final_output_path), exist_ok=True)
+
+# Helper Functions
 def validate_labor_with_AI_skill(df):
     if not df['labor_with_AI_skill'].isin([0, 1]).all():
         raise ValueError("Invalid 'labor_with_AI_skill' values.")
 
-# Process each interim file
-for filename in os.listdir(interim_input_directory):
-    if filename.startswith("interim_combined") and filename.endswith(".csv"):
-        input_file = os.path.join(interim_input_directory, filename)
-        df = pd.read_csv(input_file)
-
-        validate_labor_with_AI_skill(df)
-        df['rcid_total'] = df.groupby(['rcid', 'year'])['user_id'].transform('nunique')
-
-        df.to_csv(os.path.join(output_directory, f"filtered_{filename}"), index=False)
-        del df
-        gc.collect()
-
-print("Part 3 completed successfully.")
-
-
-# ========================================================
-# (Part 4) Export Final Firm-Year Level Data
-# ========================================================
-# - Combine all filtered interim files into a single CSV.
-# - Output: Final dataset at the firm-year level.
-# --------------------------------------------------------
-import pandas as pd
-import os
-import gc
-
-# Paths
-input_directory = r"~\interim"
-final_output_path = r"~\final\firm_year_final.csv"
-
-# Combine all files into a single DataFrame
-dataframes = []
-for filename in os.listdir(input_directory):
-    if filename.startswith("filtered") and filename.endswith(".csv"):
-        df = pd.read_csv(os.path.join(input_directory, filename))
-        dataframes.append(df)
-
-final_df = pd.concat(dataframes, ignore_index=True)
-final_df.to_csv(final_output_path, index=False)
+def count_users_per_year(spans, key):
+    """Count distinct users per (key, year) from spans sorted by (key, user_id, start_year)."""
+    if spans.empty:
+        return pd.Series(dtype='int32', index=pd.MultiIndex.from_arrays([[], []], names=[key, 'year']))
+
+    # Merge overlapping spans of the same user within a key, so each user-year counts once
+    run_end = spans.groupby([key, 'user_id'])['end_year'].cummax()
+    same_user = (spans[key] == spans[key].shift()) & (spans['user_id'] == spans['user_id'].shift())
+    new_block = ~same_user | (spans['start_year'] > run_end.shift())
+    merged = spans.assign(end_year=run_end).groupby(new_block.cumsum().to_numpy()).agg(
+        {key: 'first', 'start_year': 'min', 'end_year': 'max'}
+    )
+
+    # Sweep line over sorted edge events: +1 at the start year, -1 the year after the end.
+    # Only years with an edge are visited (no dense key x year grid), and since every
+    # key's edges sum to zero, one running total restarts at zero for each key
+    edges = pd.DataFrame({
+        key: np.tile(merged[key].to_numpy(), 2),
+        'year': np.concatenate([merged['start_year'].to_numpy(np.int64), merged['end_year'].to_numpy(np.int64) + 1]),
+        'delta': np.repeat(np.array([1, -1], dtype=np.int32), len(merged)),
+    }).groupby([key, 'year'], sort=True)['delta'].sum()
+    edge_keys = edges.index.get_level_values(key).to_numpy()
+    edge_years = edges.index.get_level_values('year').to_numpy()
+    running = edges.to_numpy().cumsum()
+
+    # Each nonzero running count holds from its edge year up to the key's next edge
+    # (a key's last edge always brings the count back to zero)
+    active = np.flatnonzero(running)
+    lengths = edge_years[active + 1] - edge_years[active]
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    index = pd.MultiIndex.from_arrays(
+        [np.repeat(edge_keys[active], lengths), np.repeat(edge_years[active], lengths) + offsets],
+        names=[key, 'year']
+    )
+    return pd.Series(np.repeat(running[active], lengths), index=index)
+
+def count_distinct_users(spans, key):
+    """Distinct users per (key, year): all, technical-team roles, AI-skilled, and both."""
+    is_tag = spans['tag'].eq(1).fillna(False).astype(bool)
+    is_AI_skill = spans['labor_with_AI_skill'] == 1
+    return (
+        pd.concat({
+            f'{key}_total': count_users_per_year(spans, key),
+            f'{key}_tag': count_users_per_year(spans[is_tag], key),
+            f'{key}_AI_skill': count_users_per_year(spans[is_AI_skill], key),
+            f'{key}_tag_AI_skill': count_users_per_year(spans[is_tag & is_AI_skill], key),
+        }, axis=1)
+        .fillna(0)
+        .astype('int32')
+        .sort_index()
+    )
+
+# Only the Part 2 files (Part 1's interim files share the directory)
+interim_files = sorted(
+    os.path.join(interim_input_directory, filename)
+    for filename in os.listdir(interim_input_directory)
+    if filename.startswith("interim_combined") and filename.endswith(".parquet")
+)
+dataset = ds.dataset(interim_files, format='parquet')
+
+# One row per position: far smaller than the user-year panel
+spans = dataset.to_table(
+    columns=['rcid', 'id_parat', 'user_id', 'start_year', 'end_year', 'tag', 'labor_with_AI_skill']
+).to_pandas()
+validate_labor_with_AI_skill(spans)
+
+# Factorize the firm IDs once into dense int32 codes (sorted, so code order is ID order);
+# the sorts, span merges and sweep lines below all work on these codes
+spans = spans.drop_duplicates()
+rcid_codes, rcids = pd.factorize(spans['rcid'], sort=True)
+spans['rcid'] = rcid_codes.astype(np.int32)
+parat_codes, parats = pd.factorize(spans['id_parat'], sort=True)
+spans['id_parat'] = parat_codes.astype(np.int32)  # -1 where the firm has no id_parat
+
+# Distinct users per firm-year (rcid)
+spans = spans.sort_values(['rcid', 'user_id', 'start_year'], ignore_index=True)
+firm_year = count_distinct_users(spans, 'rcid').reset_index()
+
+# Distinct users per id_parat-year, attached to each firm-year of that id_parat
+# (missing for firms without an id_parat)
+parat_spans = spans[spans['id_parat'] >= 0].sort_values(['id_parat', 'user_id', 'start_year'], ignore_index=True)
+parat_year = count_distinct_users(parat_spans, 'id_parat')
+parat_of_rcid = spans.groupby('rcid')['id_parat'].first()
+firm_year.insert(1, 'id_parat', firm_year['rcid'].map(parat_of_rcid))
+firm_year = firm_year.join(parat_year, on=['id_parat', 'year'])
+firm_year[parat_year.columns] = firm_year[parat_year.columns].astype('Int32')
+
+# Back from codes to the original IDs
+firm_year['rcid'] = rcids.take(firm_year['rcid'].to_numpy())
+firm_year['id_parat'] = pd.Series(pd.Categorical.from_codes(firm_year['id_parat'], categories=parats)).astype('Int64')
+firm_year['year'] = firm_year['year'].astype('int16')
+firm_year.to_parquet(final_output_path, engine='pyarrow', compression='snappy', index=False)
 
 print(f"Final firm-year level dataset saved to: {final_output_path}")
-print("Part 4 completed successfully.")
+print("Part 3 completed successfully.")
@@ -5,7 +5,7 @@
 # This script collects data center information from https://www.datacenters.com/locations.
 # Example data includes: Name, Description, Location (Address, Latitude, Longitude), and Size.
 #
-# Libraries used: Selenium, BeautifulSoup, JSON, CSV
+# Libraries used: Selenium, httpx (asyncio), lxml, JSON, CSV
 # --------------------------------------------------------
 
 # ==========================
@@ -13,21 +13,43 @@
 # ==========================
 import time
 import csv
+import asyncio
+import httpx
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
-from bs4 import BeautifulSoup
+from lxml import etree, html
 import json
 import re
 from datetime import datetime
+from contextlib import ExitStack
 
 # ==========================
 # 2. Configuration
 # ==========================
 DRIVER_PATH = r"~\chromedriver.exe"  # Path to ChromeDriver
+MAX_CONNECTIONS = 32  # Concurrent HTTP connections for data center pages
+REQUEST_TIMEOUT = 30  # Seconds
+MAX_BROWSERS = 2  # Concurrent headless Chrome instances for the rendering fallback
+
+# Compiled XPath queries for the two JSON <script> blobs on each data center page
+# (6th child of div.page-wrapper, and the react-on-rails component script)
+LOCATION_SCRIPT_XPATH = etree.XPath(
+    "/html/body/div[contains(concat(' ', normalize-space(@class), ' '), ' page-wrapper ')]/*[6][self::script]/text()"
+)
+REACT_SCRIPT_XPATH = etree.XPath(
+    "/html/body/script[contains(concat(' ', normalize-space(@class), ' '), ' js-react-on-rails-component ')]/text()"
+)
+
+# CSV column holding, as a JSON object, any location fields not in the header
+# (the header is fixed from the first scraped page)
+EXTRA_FIELD = "extra"
+
+# HTML tags or runs of non-ASCII characters, removed by clean_text in a single pass
+CLEAN_TEXT_PATTERN = re.compile(r"</?[^>]+>|[^\x00-\x7F]+")
 
 
 # ==========================
@@ -45,9 +67,7 @@ def setup_driver():
 
 def clean_text(text):
     """Clean text by removing HTML tags and non-ASCII characters."""
-    clean_text = re.sub(r"<\/?[^>]+>", "", text)
-    clean_text = clean_text.encode('ascii', 'ignore').decode('ascii')
-    return clean_text.strip()
+    return CLEAN_TEXT_PATTERN.sub("", text).strip()
 
 
 def format_date(date_string):
@@ -90,21 +110,48 @@ def get_data_center_urls(driver, page_number):
     return urls
 
 
-def extract_data_from_url(url):
-    """Extract detailed information from a data center webpage."""
+def render_page(url):
+    """Render a webpage with headless Chrome (fallback for JS-injected content)."""
     driver = setup_driver()
-    driver.get(url)
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    driver.quit()
+    try:
+        driver.get(url)
+        return driver.page_source
+    finally:
+        driver.quit()
+
+
+async def extract_data_from_url(client, browser_slots, url):
+    """Extract detailed information from a data center webpage."""
+    print(f"Processing {url}")
+    try:
+        response = await client.get(url)
+        response.raise_for_status()
+        tree = html.fromstring(response.text)
+        location_script = LOCATION_SCRIPT_XPATH(tree)
+    except (httpx.HTTPError, etree.ParserError) as e:
+        # e.g. 403/429 from bot protection or an empty body: a real browser may still get through
+        print(f"Error fetching {url}: {e}")
+        location_script = []
+
+    # The JSON <script> blobs are served in the static HTML; only render with
+    # Selenium if the plain request failed or lacks the location script
+    if not location_script:
+        try:
+            async with browser_slots:  # Each render starts a full Chrome; only a few at a time
+                page_source = await asyncio.to_thread(render_page, url)
+            tree = html.fromstring(page_source)
+        except Exception as e:
+            print(f"Error rendering {url}: {e}")
+            return None
+        location_script = LOCATION_SCRIPT_XPATH(tree)
 
     # Extract location data from script
-    location_script = soup.select_one("body > div.page-wrapper > script:nth-child(6)")
     if not location_script:
         print(f"Location data not found for {url}")
         return None
 
     try:
-        location_data = json.loads(location_script.string.strip())
+        location_data = json.loads(location_script[0])
         flattened_data = {key: value for key, value in location_data.get("location", {}).items()}
         for field in ["description", "summary", "fullAddress"]:
             if field in flattened_data:
@@ -115,10 +162,10 @@ def extract_data_from_url(url):
 
     # Extract creation and update dates
     created_at, updated_at = "N/A", "N/A"
-    react_script = soup.select_one("body > script.js-react-on-rails-component")
+    react_script = REACT_SCRIPT_XPATH(tree)
     if react_script:
         try:
-            react_data = json.loads(react_script.string.strip())
+            react_data = json.loads(react_script[0])
             resources = react_data.get("resources", [])
             for resource in resources:
                 if resource.get("id") == 1:
@@ -133,62 +180,122 @@ def extract_data_from_url(url):
     return flattened_data
 
 
+def open_http_client():
+    """Create the pooled HTTP client shared by the whole crawl."""
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS)
+    return httpx.AsyncClient(limits=limits, timeout=REQUEST_TIMEOUT, follow_redirects=True)
+
+
+async def extract_data_from_urls(client, browser_slots, urls):
+    """Extract information from many data center webpages concurrently over the shared client."""
+    results = await asyncio.gather(
+        *(extract_data_from_url(client, browser_slots, url) for url in urls), return_exceptions=True
+    )
+
+    # One failing URL must not abort the rest of the page
+    data = []
+    for url, result in zip(urls, results):
+        if isinstance(result, Exception):
+            print(f"Error processing {url}: {result!r}")
+        elif result:
+            data.append(result)
+    return data
+
+
 # ==========================
 # 5. Output Functions
 # ==========================
-def save_to_csv(data, filename):
-    """Save data to a CSV file."""
+def get_fieldnames(data):
+    """Build the CSV column order from a sample of scraped records."""
     fixed_order = ["id", "name", "description", "summary"]
     dynamic_fields = set()
     for entry in data:
         dynamic_fields.update(entry.keys())
 
-    dynamic_fields = list(dynamic_fields - set(fixed_order))
-    fieldnames = fixed_order + dynamic_fields
+    return fixed_order + sorted(dynamic_fields - set(fixed_order)) + [EXTRA_FIELD]
+
 
-    with open(filename, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(data)
+def to_csv_row(record, fieldnames, unseen_fields):
+    """Move fields missing from the CSV header into the JSON extra column, logging each new one."""
+    extra = {key: value for key, value in record.items() if key not in fieldnames}
+    if not extra:
+        return record
+    for key in extra.keys() - unseen_fields:
+        print(f"Field '{key}' is not in the CSV header; saving it in the '{EXTRA_FIELD}' column")
+    unseen_fields.update(extra)
+    row = {key: value for key, value in record.items() if key in fieldnames}
+    row[EXTRA_FIELD] = json.dumps(extra)
+    return row
 
-    print(f"Data saved to {filename}")
+
+def open_csv_writer(filename, fieldnames):
+    """Open a CSV file for streaming rows; returns (file, writer)."""
+    file = open(filename, mode='w', newline='', encoding='utf-8')
+    writer = csv.DictWriter(file, fieldnames=fieldnames)
+    writer.writeheader()
+    return file, writer
 
 
 # ==========================
 # 6. Main Function
 # ==========================
-def main():
+async def main():
     """Main script for data collection."""
-    driver = setup_driver()
-    all_data = []
+    final_filename = r"~\final.csv"
+    fieldnames = None
+    unseen_fields = set()  # Fields first seen after the header was written
+    final_file = final_writer = None
 
     # Define page ranges to scrape
     page_ranges = [(1, 50), (51, 100), (101, 105)]
 
-    for start, end in page_ranges:
-        data = []
-        for page_number in range(start, end + 1):
-            print(f"Processing page {page_number}...")
-            urls = get_data_center_urls(driver, page_number)
-
-            for url in urls:
-                print(f"Processing {url}")
-                result = extract_data_from_url(url)
-                if result:
-                    data.append(result)
-
-        # Save intermediate results
-        filename = f"~\\data_page_{start}_to_{end}.csv"
-        save_to_csv(data, filename)
-        all_data.extend(data)
-
-    driver.quit()
-
-    # Save final merged data
-    save_to_csv(all_data, r"~\final.csv")
+    # The browser and every CSV file are closed even if the crawl stops with an error
+    with ExitStack() as stack:
+        driver = setup_driver()
+        stack.callback(driver.quit)
+
+        # One HTTP client (and connection pool) and one browser limit for the whole crawl
+        async with open_http_client() as client:
+            browser_slots = asyncio.Semaphore(MAX_BROWSERS)
+
+            for start, end in page_ranges:
+                filename = f"~\\data_page_{start}_to_{end}.csv"
+                range_file = range_writer = None
+
+                with ExitStack() as range_stack:
+                    for page_number in range(start, end + 1):
+                        print(f"Processing page {page_number}...")
+                        urls = await asyncio.to_thread(get_data_center_urls, driver, page_number)
+
+                        # Fetch the page's data centers concurrently
+                        data = await extract_data_from_urls(client, browser_slots, urls)
+                        if not data:
+                            continue
+
+                        # Fix the column order from the first scraped page; fields first seen on a
+                        # later page go to the JSON extra column instead of being dropped
+                        if fieldnames is None:
+                            fieldnames = get_fieldnames(data)
+                            final_file, final_writer = open_csv_writer(final_filename, fieldnames)
+                            stack.enter_context(final_file)
+                        if range_writer is None:
+                            range_file, range_writer = open_csv_writer(filename, fieldnames)
+                            range_stack.enter_context(range_file)
+
+                        # Stream rows to the intermediate and final files page by page
+                        rows = [to_csv_row(record, fieldnames, unseen_fields) for record in data]
+                        for file, writer in ((range_file, range_writer), (final_file, final_writer)):
+                            writer.writerows(rows)
+                            file.flush()
+
+                if range_file is not None:
+                    print(f"Data saved to {filename}")
+
+    if final_file is not None:
+        print(f"Data saved to {final_filename}")
 
 # ==========================
 # 7. Script Execution
 # ==========================
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
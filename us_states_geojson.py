@@ -0,0 +1,116 @@
+# ========================================================
+# Python Script: Simplified U.S. State Outlines for the Emissions Map
+# ========================================================
+# Purpose:
+# This script builds us_states.geojson, the state outlines used by
+# visual_state_emissions.py, from the Census Bureau's cartographic boundaries.
+#
+# Data Source:
+# "cb_2016_us_state_500k" (2016 cartographic boundary file, 1:500,000)
+# from https://www.census.gov/geographies/mapping-files/time-series/geo/carto-boundary-file.html
+#
+# Key Features:
+# - Keeps the 50 states and DC (territories such as Puerto Rico are dropped).
+# - Simplifies every ring with Douglas-Peucker and rounds coordinates to 3 decimals.
+# - Drops islands too small to see at national zoom.
+# - Writes compact, name-sorted GeoJSON so rebuilds give the same file.
+#
+# Libraries Used: pyshp, json
+# --------------------------------------------------------
+
+# ==========================
+# 1. Import Libraries
+# ==========================
+import shapefile  # pyshp
+import json
+
+# ==========================
+# 2. Configuration
+# ==========================
+census_url = "https://www2.census.gov/geo/tiger/GENZ2016/shp/cb_2016_us_state_500k.zip"
+output_file = "us_states.geojson"
+
+tolerance = 0.02  # Douglas-Peucker tolerance in degrees (~2 km)
+coordinate_digits = 3  # ~100 m, far below a pixel at national zoom
+min_area = 0.001  # Parts smaller than this (in square degrees) are dropped
+max_state_fips = 56  # States and DC have FIPS codes up to 56; territories start at 60
+
+# ==========================
+# 3. Geometry Helpers
+# ==========================
+def douglas_peucker(points):
+    """Keep only the vertices that deviate more than the tolerance from the simplified line."""
+    if len(points) < 3:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        dx, dy = x2 - x1, y2 - y1
+        length_squared = dx * dx + dy * dy
+        farthest, farthest_index = -1.0, None
+        for i in range(first + 1, last):
+            px, py = points[i]
+            t = 0.0 if length_squared == 0 else max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / length_squared))
+            distance = (px - x1 - t * dx) ** 2 + (py - y1 - t * dy) ** 2
+            if distance > farthest:
+                farthest, farthest_index = distance, i
+        if farthest_index is not None and farthest > tolerance * tolerance:
+            keep[farthest_index] = True
+            stack += [(first, farthest_index), (farthest_index, last)]
+    return [point for point, kept in zip(points, keep) if kept]
+
+def round_ring(ring):
+    """Round a ring and drop the repeated vertices that rounding creates."""
+    rounded = [[round(x, coordinate_digits), round(y, coordinate_digits)] for x, y in ring]
+    return [point for i, point in enumerate(rounded) if i == 0 or point != rounded[i - 1]]
+
+def simplify_ring(ring):
+    """Simplify and round a ring; None if it collapses below a valid ring (closed, 3+ corners)."""
+    simplified = round_ring(douglas_peucker([tuple(point[:2]) for point in ring]))
+    return simplified if len(simplified) >= 4 else None
+
+def ring_area(ring):
+    """Unsigned shoelace area of a ring, in square degrees."""
+    return abs(sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:]))) / 2
+
+# ==========================
+# 4. Build the Outlines
+# ==========================
+features = []
+with shapefile.Reader(census_url) as reader:  # pyshp downloads and unpacks the zip itself
+    for shape_record in reader.iterShapeRecords():
+        if int(shape_record.record['STATEFP']) > max_state_fips:
+            continue
+        geometry = shape_record.shape.__geo_interface__
+        polygons = [geometry['coordinates']] if geometry['type'] == "Polygon" else geometry['coordinates']
+
+        parts = []
+        for polygon in polygons:
+            exterior = simplify_ring(polygon[0])
+            if exterior is None or ring_area(exterior) < min_area:
+                continue
+            holes = [hole for hole in map(simplify_ring, polygon[1:]) if hole]
+            parts.append([exterior] + holes)
+        if not parts:  # Never drop a whole state: keep its largest part, rounded only
+            largest = max(polygons, key=lambda polygon: len(polygon[0]))
+            parts = [[round_ring(largest[0])]]
+
+        features.append({
+            "type": "Feature",
+            "properties": {"name": shape_record.record['NAME']},
+            "geometry": {"type": "Polygon", "coordinates": parts[0]} if len(parts) == 1
+                        else {"type": "MultiPolygon", "coordinates": parts}
+        })
+
+features.sort(key=lambda feature: feature['properties']['name'])
+
+# ==========================
+# 5. Save the GeoJSON
+# ==========================
+with open(output_file, "w", encoding="utf-8") as file:
+    json.dump({"type": "FeatureCollection", "features": features}, file, separators=(",", ":"))
+
+print(f"{len(features)} state outlines have been saved to {output_file}.")
@@ -10,11 +10,14 @@
 # from https://www.eia.gov/environment/emissions/state/
 #
 # Key Features:
-# - Dynamic visualization with year-by-year data using a slider.
+# - Dynamic visualization with year-by-year data using a slider
+#   (set YEAR_STEP, e.g. YEAR_STEP=5, for fewer, coarser frames).
 # - Uses Plotly for interactive mapping and visualization.
-# - Outputs the map to an HTML file for browser viewing.
+# - One WebGL map trace (MapLibre) animated through per-year frames.
+# - Outputs the map to an HTML file for browser viewing
+#   (set PREVIEW=1 to open it in the browser without writing the file).
 #
-# Libraries Used: pandas, plotly, os, webbrowser, requests
+# Libraries Used: pandas, pyarrow, plotly, os, sys, shutil, hashlib, pathlib, webbrowser, requests, json, runpy
 # --------------------------------------------------------
 
 # ==========================
@@ -23,23 +26,100 @@
 import pandas as pd
 import plotly.graph_objects as go
 import webbrowser
+import requests
+import json
+import runpy
 import os
+import sys
+import shutil
+import hashlib
+from pathlib import Path
 
 # ==========================
 # 2. Download and Load Data
 # ==========================
+def download(url, path):
+    """Stream url to path; a copy fetched earlier is revalidated with its saved ETag."""
+    etag_file = path + ".etag"
+    if os.path.exists(path) and not os.path.exists(etag_file):
+        return  # Local copy that was not downloaded here (e.g. from the repository)
+
+    headers = {}
+    if os.path.exists(path):
+        with open(etag_file, encoding="utf-8") as file:
+            headers["If-None-Match"] = file.read().strip()
+
+    try:
+        with requests.get(url, headers=headers, stream=True, timeout=30) as response:
+            if response.status_code == 304:
+                return  # Unchanged since the last download
+            response.raise_for_status()
+            # Write to a temporary file first so an interrupted download is never mistaken for the data
+            with open(path + ".part", "wb") as file:
+                for chunk in response.iter_content(chunk_size=65536):
+                    file.write(chunk)
+            os.replace(path + ".part", path)
+            if "ETag" in response.headers:
+                with open(etag_file, "w", encoding="utf-8") as file:
+                    file.write(response.headers["ETag"])
+    except requests.RequestException:
+        if not os.path.exists(path):
+            raise
+        print(f"Could not revalidate {path}; using the local copy.")
+
 # Define file location and GitHub repository
-github_url = "https://raw.githubusercontent.com/soo-hs-kim/ai-and-co2"
+github_url = "https://raw.githubusercontent.com/soo-hs-kim/ai-and-co2/main"
 file_name = "eia_emissions_commercial.xlsx"
 
-# Check if the file exists locally, otherwise download it
-if not os.path.exists(file_name):
-    response = requests.get(github_url)
-    with open(file_name, "wb") as file:
-        file.write(response.content)
+# Use the local file if present, otherwise download it
+download(f"{github_url}/{file_name}", file_name)
+
+# Load data into a pandas DataFrame; the parsed sheet is cached as Parquet and
+# rebuilt only when the Excel file is newer than the cache
+parquet_file = os.path.splitext(file_name)[0] + ".parquet"
+if not os.path.exists(parquet_file) or os.path.getmtime(parquet_file) < os.path.getmtime(file_name):
+    pd.read_excel(
+        file_name,
+        usecols=['state', 'year', 'emissions'],
+        # int16 is a compact groupby key; Plotly embeds z as raw typed-array bytes, so float32 halves them
+        dtype={'state': 'string', 'year': 'int16', 'emissions': 'float32'}
+    ).to_parquet(parquet_file, engine='pyarrow', index=False)
+df = pd.read_parquet(parquet_file)
+
+# U.S. state boundaries for the WebGL map trace. A simplified copy of the Census Bureau's
+# 2016 cartographic boundaries ships with the repository; if it is missing, it is rebuilt
+# from the same Census file by us_states_geojson.py (requires pyshp)
+geojson_file = "us_states.geojson"
+
+if not os.path.exists(geojson_file):
+    runpy.run_path("us_states_geojson.py")
+
+# Output file and optional coarser slider: YEAR_STEP=5 keeps every fifth year (plus the latest one)
+output_path = r"state_emissions_map.html"
+year_step = int(os.environ.get("YEAR_STEP", "1"))
+preview = os.environ.get("PREVIEW") == "1"  # Show the map in a browser instead of exporting it
+
+# The map only depends on the data, the state outlines, this script and YEAR_STEP;
+# if none of them changed since an earlier run, reuse that run's HTML
+input_hash = hashlib.blake2b(str(year_step).encode(), digest_size=8)
+for path in (file_name, geojson_file, __file__):
+    with open(path, "rb") as file:
+        input_hash.update(file.read())
+cache_directory = ".cache"
+max_cached_maps = 4  # Only the most recently used maps are kept
+cached_html = os.path.join(cache_directory, f"{input_hash.hexdigest()}.html")
+
+if os.path.exists(cached_html):
+    os.utime(cached_html)  # Mark as recently used
+    if preview:
+        webbrowser.open(Path(cached_html).resolve().as_uri())  # Open the cached copy; nothing is written
+    else:
+        shutil.copyfile(cached_html, output_path)
+        print(f"Inputs unchanged; cached visualization copied to {output_path}.")
+    sys.exit()
 
-# Load data into a pandas DataFrame
-df = pd.read_excel(file_name)
+with open(geojson_file, encoding="utf-8") as file:
+    states_geojson = json.load(file)
 
 # ==========================
 # 3. Data Preparation
@@ -60,7 +140,13 @@ state_abbreviation_mapping = {
     "West Virginia": "WV", "Wisconsin": "WI", "Wyoming": "WY"
 }
 
-df['state'] = df['state'].map(state_abbreviation_mapping)
+# As a categorical, each distinct state name is looked up once rather than once per row
+df['state'] = df['state'].astype('category').map(state_abbreviation_mapping)
+
+# Key each GeoJSON feature by the same state abbreviation used in the data
+# (the outlines are already simplified and rounded by us_states_geojson.py)
+for feature in states_geojson['features']:
+    feature['id'] = state_abbreviation_mapping.get(feature['properties']['name'])
 
 # Filter data for the desired year range
 df = df[df['year'].between(1970, 2022)]  
@@ -69,42 +155,58 @@ df = df.dropna(subset=['state', 'emissions'])  # Remove rows with missing values
 # ==========================
 # 4. Visualization Setup
 # ==========================
-fig = go.Figure()
+# Shared color range, computed once
+zmin, zmax = float(df['emissions'].min()), float(df['emissions'].max())
 
-# Extract unique years for slider functionality
-years = sorted(df['year'].unique())
+# Year x state matrix: every year's z values share one state order, so the
+# locations are stored once on the trace and each frame only carries z
+emissions = df.pivot(index='year', columns='state', values='emissions').sort_index()
 
-# Add a choropleth trace for each year
-for year in years:
-    year_data = df[df['year'] == year]
-    fig.add_trace(
-        go.Choropleth(
-            locations=year_data['state'],  
-            z=year_data['emissions'],  
-            locationmode="USA-states",  
-            colorscale="Reds",  
-            zmin=df['emissions'].min(),
-            zmax=df['emissions'].max(),
-            colorbar_title="Emissions",
-            hoverinfo="location+z",
-            visible=(year == years[0])  # Only the first year is visible initially
+# Optional coarser slider (YEAR_STEP, see above)
+if year_step > 1:
+    emissions = emissions.iloc[sorted(set(range(0, len(emissions), year_step)) | {len(emissions) - 1})]
+states = emissions.columns.astype(str).to_numpy()
+years = emissions.index.tolist()  # Unique years for slider functionality
+z_by_year = emissions.to_numpy()
+
+# One frame per year
+frames = []
+for year, z in zip(years, z_by_year):
+    frames.append(
+        go.Frame(
+            name=str(year),
+            data=[go.Choroplethmap(z=z)],
+            layout=dict(title=f"State-Level Emissions in the U.S. - Year {year}")
         )
     )
 
+# A single WebGL choropleth trace holds the geometry, locations and styling; it starts at the first year
+fig = go.Figure(
+    data=[
+        go.Choroplethmap(
+            geojson=states_geojson,
+            locations=states,
+            z=z_by_year[0],
+            coloraxis="coloraxis",  # Color scale, range and colorbar live once in the layout
+            hoverinfo="location+z"
+        )
+    ],
+    frames=frames
+)
+
 # ==========================
 # 5. Create Slider for Years
 # ==========================
 steps = []
-for i, year in enumerate(years):
+for year in years:
     step = dict(
-        method="update",
+        method="animate",
         args=[
-            {"visible": [False] * len(fig.data)},  # Hide all traces
-            {"title": f"State-Level Emissions in the U.S. - Year {year}"}
+            [str(year)],  # Jump to the frame for this year
+            {"mode": "immediate", "frame": {"duration": 0, "redraw": True}, "transition": {"duration": 0}}
         ],
     )
-    step["args"][0]["visible"][i] = True  # Show trace for the current year
-    step["label"] = str(year)  
+    step["label"] = str(year)
     steps.append(step)
 
 sliders = [dict(
@@ -120,19 +222,44 @@ sliders = [dict(
 fig.update_layout(
     sliders=sliders,
     title="Interactive State-Level Emissions in the U.S. (1970–2022)",
-    geo=dict(
-        scope="usa",
-        projection_type="albers usa",
-        showframe=False,
-        showcoastlines=True
+    coloraxis=dict(
+        colorscale="Reds",
+        cmin=zmin,
+        cmax=zmax,
+        colorbar=dict(title="Emissions")
+    ),
+    # Web Mercator has no Alaska/Hawaii insets, so frame their real positions:
+    # this view keeps all 50 states and DC on screen down to an ~800x420 plot area
+    map=dict(
+        style="white-bg",
+        center=dict(lat=52, lon=-127),
+        zoom=1.75
     )
 )
 
 # ==========================
 # 7. Save and Open the Map
 # ==========================
-output_path = r"state_emissions_map.html"
-fig.write_html(output_path)
+if preview:
+    # Plotly serves the figure to the browser from a short-lived local server; no HTML file is written
+    fig.show(renderer="browser", config={"displaylogo": False, "responsive": True})
+else:
+    # Load plotly.js from the CDN instead of inlining ~3 MB of it into the file
+    fig.write_html(
+        output_path,
+        include_plotlyjs="cdn",
+        include_mathjax=False,
+        full_html=True,
+        config={"displaylogo": False, "responsive": True},
+        auto_play=False
+    )
+
+    # Keep a copy for later runs with the same inputs, dropping the least recently used ones
+    os.makedirs(cache_directory, exist_ok=True)
+    shutil.copyfile(output_path, cached_html)
+    cached_maps = sorted(Path(cache_directory).glob("*.html"), key=os.path.getmtime, reverse=True)
+    for stale_map in cached_maps[max_cached_maps:]:
+        stale_map.unlink()
 
-print(f"Visualization has been saved to {output_path}. Open this file in a browser to view the interactive map.")
+    print(f"Visualization has been saved to {output_path}. Open this file in a browser to view the interactive map.")
 